@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from server import util
 
@@ -37,6 +37,11 @@ METRIC_GROUPS = (
 )
 
 
+_FLAT_METRICS: Tuple[Tuple[str, str], ...] = tuple(
+    (suffix, form_key) for _, group in METRIC_GROUPS for suffix, form_key in group
+)
+
+
 def build_lines(
     form_data: Dict[str, str],
     metric_prefix: str,
@@ -50,13 +55,10 @@ def build_lines(
     )
 
     lines: List[str] = []
-    for heading, metrics in METRIC_GROUPS:
-        group_lines: List[str] = []
-        for suffix, form_key in metrics:
-            group_lines.extend(
-                builder.build_line(suffix, form_data.get(form_key))
-            )
-        if group_lines:
-            lines.extend(group_lines)
+    extend = lines.extend
+    build_line = builder.build_line
+    get = form_data.get
+    for suffix, form_key in _FLAT_METRICS:
+        extend(build_line(suffix, get(form_key)))
 
     return lines
@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, Sequence, Tuple
 
 from flask import Blueprint, current_app, redirect, render_template, request, url_for
 
@@ -21,6 +21,21 @@ METADATA = {
     "description": "Ingest Data Domain storage metrics into Dynatrace.",
 }
 
+_DEFAULT_FIELDS = (
+    "totalBytes",
+    "usedBytes",
+    "availableBytes",
+    "criticalAlerts",
+    "warningAlerts",
+    "enclosuresNormal",
+    "enclosuresDegraded",
+    "drivesOperational",
+    "drivesSpare",
+    "drivesFailed",
+)
+
+_HEALTH_RESPONSE = (b"ok", 200, {"Content-Type": "text/plain; charset=utf-8"})
+
 
 @bp.route("/", methods=["GET"])
 def form():
@@ -40,19 +55,24 @@ def form():
 
 @bp.route("/health", methods=["GET"])
 def health():
-    return ("ok", 200, {"Content-Type": "text/plain; charset=utf-8"})
+    return _HEALTH_RESPONSE
 
 
 @bp.route("/ingest", methods=["POST"])
 def ingest():
+    rejected = util.reject_form_request(request.content_length, request.mimetype)
+    if rejected:
+        return rejected
+
     tenants = util.TenantRegistry.load()
     form_data = request.form
+    fg = form_data.get
 
     expected_password = current_app.config.get("AUTH_PASSWORD", "")
     if not expected_password:
         return ("AUTH_PASSWORD is not configured on the server", 500)
 
-    auth_password = form_data.get("auth_password")
+    auth_password = fg("auth_password")
     if not auth_password or auth_password != expected_password:
         return ("Unauthorized", 401)
 
@@ -60,39 +80,39 @@ def ingest():
     if not tenant_ids:
         return redirect(url_for("datadomain.form", error="Select at least one tenant."))
 
-    dt_token = form_data.get("dt_token")
+    dt_token = fg("dt_token")
     if not dt_token:
         return redirect(url_for("datadomain.form", error="Provide a Dynatrace access token."))
 
     timestamp_ms = util.current_time_ms()
 
-    tenant_results: List[Dict[str, object]] = []
-    overall_success = True
+    tenant_results: List[util.TenantResult] = []
+    pending: Dict[Tuple[str, str], List[Tuple[util.Tenant, util.TenantResult]]] = {}
 
     logger.info("Ingest request received for tenants: %s", ",".join(tenant_ids))
 
+    default_prefix = current_app.config["METRIC_PREFIX"]
+    log_info = logger.info
+
     for tenant_id in tenant_ids:
         tenant = tenants.get(tenant_id)
         if not tenant:
             tenant_results.append(
-                {
-                    "label": tenant_id,
-                    "status": "n/a",
-                    "message": "Unknown tenant",
-                    "success": False,
-                    "lines": "",
-                    "response_text": "",
-                }
+                util.TenantResult(
+                    label=tenant_id,
+                    status="n/a",
+                    message="Unknown tenant",
+                    success=False,
+                )
             )
-            overall_success = False
             continue
 
-        logger.info("Preparing ingest payload for tenant %s", tenant.id)
+        log_info("Preparing ingest payload for tenant %s", tenant.id)
 
-        host_value = _first_non_empty(form_data.get("host"), form_data.get("system"))
-        environment_value = _first_non_empty(
-            form_data.get("environment"), form_data.get("site")
-        )
+        host_value = (fg("host") or "").strip() or (fg("system") or "").strip()
+        environment_value = (fg("environment") or "").strip() or (
+            fg("site") or ""
+        ).strip()
 
         if not host_value or not environment_value:
             return redirect(
@@ -108,59 +128,38 @@ def ingest():
             "host": host_value,
             "environment": environment_value,
         }
-        merged_dims = util.merge_dimensions(tenant.static_dims, dims)
-        metric_prefix = tenant.metric_prefix or current_app.config["METRIC_PREFIX"]
+        merged_dims = util.merge_dimensions(tenant.sanitized_static_dims, dims)
+        metric_prefix = tenant.metric_prefix or default_prefix
         lines = metrics.build_lines(form_data, metric_prefix, merged_dims, timestamp_ms)
 
         if not lines:
             tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": "n/a",
-                    "message": "No numeric values provided",
-                    "success": False,
-                    "lines": "",
-                    "response_text": "",
-                }
+                util.TenantResult(
+                    label=tenant.label,
+                    status="n/a",
+                    message="No numeric values provided",
+                    success=False,
+                )
             )
-            overall_success = False
             continue
 
-        try:
-            response = util.post_metrics(tenant, dt_token, lines)
-            success = response.status_code in (200, 202)
-            message = "Ingest accepted" if success else response.text or "Ingest failed"
-            logger.info(
-                "Ingest attempt for tenant %s returned status %s",
-                tenant.id,
-                response.status_code,
-            )
-            tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": response.status_code,
-                    "message": message,
-                    "success": success,
-                    "lines": "\n".join(lines),
-                    "response_text": response.text,
-                }
-            )
-            if not success:
-                overall_success = False
-        except Exception as exc:  # noqa: BLE001
-            logger.exception("Ingest error for tenant %s", tenant.id)
-            tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": "error",
-                    "message": str(exc),
-                    "success": False,
-                    "lines": "\n".join(lines),
-                    "response_text": "",
-                }
-            )
-            overall_success = False
+        result = util.TenantResult(
+            label=tenant.label,
+            status="pending",
+            message="",
+            success=False,
+            lines=lines,
+        )
+        # Lines already carry the tenant's own metric prefix and static dims,
+        # so tenants that share an environment and token can share one POST.
+        pending.setdefault((tenant.base_url, dt_token), []).append((tenant, result))
+        tenant_results.append(result)
+
+    compress = current_app.config["DT_INGEST_GZIP"]
+    for key, outcome in util.post_grouped(pending, compress).items():
+        _record_outcome(pending[key], outcome)
 
+    overall_success = all(result.success for result in tenant_results)
     overall_status = "SUCCESS" if overall_success else "FAILURE"
 
     logger.info(
@@ -178,31 +177,34 @@ def register(app):
     return bp, METADATA
 
 
-def _first_non_empty(*candidates: Optional[str]) -> str:
-    for candidate in candidates:
-        if candidate is None:
-            continue
-        stripped = candidate.strip()
-        if stripped:
-            return stripped
-    return ""
+def _record_outcome(
+    members: Sequence[Tuple[util.Tenant, util.TenantResult]], outcome: util.PostOutcome
+) -> None:
+    tenant_ids = ",".join(tenant.id for tenant, _ in members)
+    if isinstance(outcome, Exception):
+        logger.error("Ingest error for tenants %s", tenant_ids, exc_info=outcome)
+        for _, result in members:
+            result.status = "error"
+            result.message = str(outcome)
+        return
+
+    success = outcome.status_code in (200, 202)
+    message = "Ingest accepted" if success else outcome.text or "Ingest failed"
+    logger.info(
+        "Ingest attempt for tenants %s returned status %s",
+        tenant_ids,
+        outcome.status_code,
+    )
+    for _, result in members:
+        result.status = outcome.status_code
+        result.message = message
+        result.success = success
+        result.response_text = outcome.text
 
 
 def _form_defaults():
-    host_arg = request.args.get("host") or request.args.get("system")
-    environment_arg = request.args.get("environment") or request.args.get("site")
-    defaults = {
-        "host": _first_non_empty(host_arg),
-        "environment": _first_non_empty(environment_arg),
-        "totalBytes": request.args.get("totalBytes", ""),
-        "usedBytes": request.args.get("usedBytes", ""),
-        "availableBytes": request.args.get("availableBytes", ""),
-        "criticalAlerts": request.args.get("criticalAlerts", ""),
-        "warningAlerts": request.args.get("warningAlerts", ""),
-        "enclosuresNormal": request.args.get("enclosuresNormal", ""),
-        "enclosuresDegraded": request.args.get("enclosuresDegraded", ""),
-        "drivesOperational": request.args.get("drivesOperational", ""),
-        "drivesSpare": request.args.get("drivesSpare", ""),
-        "drivesFailed": request.args.get("drivesFailed", ""),
-    }
+    get_arg = request.args.get
+    defaults = {key: get_arg(key, "") for key in _DEFAULT_FIELDS}
+    defaults["host"] = (get_arg("host") or get_arg("system") or "").strip()
+    defaults["environment"] = (get_arg("environment") or get_arg("site") or "").strip()
     return defaults
@@ -6,17 +6,24 @@ from server import util
 
 
 def extract_pairs(keys: Iterable[str], values: Iterable[str]) -> Dict[str, str]:
+    # Form MultiDicts already yield str, so values are stored as given.
     pairs: Dict[str, str] = {}
     for key, value in zip(keys, values):
-        cleaned_key = (key or "").strip()
-        if not cleaned_key:
+        if not key or not value:
             continue
-        if value in (None, ""):
-            continue
-        pairs[cleaned_key] = str(value)
+        cleaned_key = key.strip()
+        if cleaned_key:
+            pairs[cleaned_key] = value
     return pairs
 
 
+def _to_float(raw_value: str) -> Optional[float]:
+    try:
+        return float(raw_value)
+    except (TypeError, ValueError):
+        return None
+
+
 def build_lines(
     metric_items: Dict[str, str],
     metric_prefix: str,
@@ -28,35 +35,40 @@ def build_lines(
 
     Metric keys are normalised to comply with Dynatrace's ingestion
     protocol before being combined with the optional prefix.
+    ``dims`` are sanitised first unless they are ``util.SanitizedDims``.
     """
 
-    lines: List[str] = []
-    skipped: List[str] = []
-    sanitized_dims = util.sanitize_dims(dims)
-    dims_fragment = ""
-    if sanitized_dims:
-        dims_fragment = "," + ",".join(f"{k}={v}" for k, v in sanitized_dims.items())
-
-    metadata_sent: Set[str] = set()
+    if not isinstance(dims, util.SanitizedDims):
+        dims = util.sanitize_dims(dims)
+    dims_fragment = util.dims_suffix(dims)
+    ts_suffix = f" {timestamp_ms}"
     unit_value = unit.strip() if unit else ""
 
-    for raw_key, raw_value in metric_items.items():
-        metric_name = util.normalise_metric_key(metric_prefix, raw_key)
-        if not metric_name:
-            skipped.append(raw_key)
-            continue
-        try:
-            numeric_value = float(raw_value)
-        except (TypeError, ValueError):
-            skipped.append(raw_key)
-            continue
-        if unit_value and metric_name not in metadata_sent:
+    normalise = util.normalise_metric_key
+    valid: List[Tuple[str, str, float]] = [
+        (raw_key, metric_name, numeric_value)
+        for raw_key, raw_value in metric_items.items()
+        if (metric_name := normalise(metric_prefix, raw_key))
+        and (numeric_value := _to_float(raw_value)) is not None
+    ]
+    accepted = {raw_key for raw_key, _, _ in valid}
+    skipped = [raw_key for raw_key in metric_items if raw_key not in accepted]
+
+    if not unit_value:
+        lines = [
+            f"{metric_name}{dims_fragment} {numeric_value}{ts_suffix}"
+            for _, metric_name, numeric_value in valid
+        ]
+        return lines, skipped
+
+    lines = []
+    metadata_sent: Set[str] = set()
+    for _, metric_name, numeric_value in valid:
+        if metric_name not in metadata_sent:
+            metadata_sent.add(metric_name)
             metadata_line = util.build_unit_metadata(metric_name, unit_value)
             if metadata_line:
                 lines.append(metadata_line)
-                metadata_sent.add(metric_name)
-        line = f"{metric_name}{dims_fragment} {numeric_value} {timestamp_ms}"
-        lines.append(line)
+        lines.append(f"{metric_name}{dims_fragment} {numeric_value}{ts_suffix}")
 
     return lines, skipped
-
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import logging
-from typing import Dict, List, Tuple
+from typing import Dict, List, Sequence, Tuple
 
 from flask import Blueprint, current_app, redirect, render_template, request, url_for
 
@@ -24,6 +24,10 @@ METADATA = {
     "description": "Submit arbitrary metrics with custom dimensions to Dynatrace.",
 }
 
+_DEFAULT_FIELDS = ("metric_unit", "ts")
+
+_HEALTH_RESPONSE = (b"ok", 200, {"Content-Type": "text/plain; charset=utf-8"})
+
 
 @bp.route("/", methods=["GET"])
 def form():
@@ -49,11 +53,15 @@ def form():
 
 @bp.route("/health", methods=["GET"])
 def health():
-    return ("ok", 200, {"Content-Type": "text/plain; charset=utf-8"})
+    return _HEALTH_RESPONSE
 
 
 @bp.route("/ingest", methods=["POST"])
 def ingest():
+    rejected = util.reject_form_request(request.content_length, request.mimetype)
+    if rejected:
+        return rejected
+
     tenants = util.TenantRegistry.load()
     form_data = request.form
 
@@ -84,8 +92,8 @@ def ingest():
     if not metric_pairs:
         return redirect(url_for("metrics.form", error="Add at least one metric."))
 
-    tenant_results: List[Dict[str, object]] = []
-    overall_success = True
+    tenant_results: List[util.TenantResult] = []
+    pending: Dict[Tuple[str, str], List[Tuple[util.Tenant, util.TenantResult]]] = {}
 
     logger.info("Generic metrics ingest request received for tenants: %s", ",".join(tenant_ids))
 
@@ -93,35 +101,29 @@ def ingest():
         tenant = tenants.get(tenant_id)
         if not tenant:
             tenant_results.append(
-                {
-                    "label": tenant_id,
-                    "status": "n/a",
-                    "message": "Unknown tenant",
-                    "success": False,
-                    "lines": "",
-                    "warnings": [],
-                }
+                util.TenantResult(
+                    label=tenant_id,
+                    status="n/a",
+                    message="Unknown tenant",
+                    success=False,
+                )
             )
-            overall_success = False
             continue
 
         token_override = form_data.get(f"dt_token__{tenant.id}")
         token_to_use = token_override or global_token
         if not token_to_use:
             tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": "n/a",
-                    "message": "Missing token",
-                    "success": False,
-                    "lines": "",
-                    "warnings": [],
-                }
+                util.TenantResult(
+                    label=tenant.label,
+                    status="n/a",
+                    message="Missing token",
+                    success=False,
+                )
             )
-            overall_success = False
             continue
 
-        merged_dims = util.merge_dimensions(tenant.static_dims, dimension_pairs)
+        merged_dims = util.merge_dimensions(tenant.sanitized_static_dims, dimension_pairs)
 
         lines, skipped = metrics.build_lines(
             metric_pairs,
@@ -133,53 +135,34 @@ def ingest():
 
         if not lines:
             tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": "n/a",
-                    "message": "No numeric metric values provided",
-                    "success": False,
-                    "lines": "",
-                    "warnings": skipped,
-                }
+                util.TenantResult(
+                    label=tenant.label,
+                    status="n/a",
+                    message="No numeric metric values provided",
+                    success=False,
+                    warnings=skipped,
+                )
             )
-            overall_success = False
             continue
 
-        try:
-            response = util.post_metrics(tenant, token_to_use, lines)
-            success = response.status_code in (200, 202)
-            message = "Ingest accepted" if success else response.text or "Ingest failed"
-            logger.info(
-                "Generic metrics ingest for tenant %s returned status %s",
-                tenant.id,
-                response.status_code,
-            )
-            tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": response.status_code,
-                    "message": message,
-                    "success": success,
-                    "lines": "\n".join(lines),
-                    "warnings": skipped,
-                }
-            )
-            if not success:
-                overall_success = False
-        except Exception as exc:  # noqa: BLE001
-            logger.exception("Generic metrics ingest error for tenant %s", tenant.id)
-            tenant_results.append(
-                {
-                    "label": tenant.label,
-                    "status": "error",
-                    "message": str(exc),
-                    "success": False,
-                    "lines": "\n".join(lines),
-                    "warnings": skipped,
-                }
-            )
-            overall_success = False
+        result = util.TenantResult(
+            label=tenant.label,
+            status="pending",
+            message="",
+            success=False,
+            lines=lines,
+            warnings=skipped,
+        )
+        # Lines already carry the tenant's static dims, so tenants that share
+        # an environment and token can share one POST.
+        pending.setdefault((tenant.base_url, token_to_use), []).append((tenant, result))
+        tenant_results.append(result)
+
+    compress = current_app.config["DT_INGEST_GZIP"]
+    for key, outcome in util.post_grouped(pending, compress).items():
+        _record_outcome(pending[key], outcome)
 
+    overall_success = all(result.success for result in tenant_results)
     overall_status = "SUCCESS" if overall_success else "FAILURE"
 
     logger.info("Generic metrics ingest completed with overall status %s", overall_status)
@@ -195,13 +178,35 @@ def register(app):
     return bp, METADATA
 
 
+def _record_outcome(
+    members: Sequence[Tuple[util.Tenant, util.TenantResult]], outcome: util.PostOutcome
+) -> None:
+    tenant_ids = ",".join(tenant.id for tenant, _ in members)
+    if isinstance(outcome, Exception):
+        logger.error("Generic metrics ingest error for tenants %s", tenant_ids, exc_info=outcome)
+        for _, result in members:
+            result.status = "error"
+            result.message = str(outcome)
+        return
+
+    success = outcome.status_code in (200, 202)
+    message = "Ingest accepted" if success else outcome.text or "Ingest failed"
+    logger.info(
+        "Generic metrics ingest for tenants %s returned status %s",
+        tenant_ids,
+        outcome.status_code,
+    )
+    for _, result in members:
+        result.status = outcome.status_code
+        result.message = message
+        result.success = success
+
+
 def _form_defaults() -> Dict[str, str]:
-    return {
-        "metric_prefix": request.args.get("metric_prefix")
-        or current_app.config["METRIC_PREFIX"],
-        "metric_unit": request.args.get("metric_unit", ""),
-        "ts": request.args.get("ts", ""),
-    }
+    get_arg = request.args.get
+    defaults = {key: get_arg(key, "") for key in _DEFAULT_FIELDS}
+    defaults["metric_prefix"] = get_arg("metric_prefix") or current_app.config["METRIC_PREFIX"]
+    return defaults
 
 
 def _parse_timestamp(ts_value: str) -> int:
@@ -1,18 +1,36 @@
+import atexit
 import importlib
 import logging
 import os
 import pathlib
-from logging.handlers import RotatingFileHandler
-from typing import Dict, List
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
 
 from flask import Flask, render_template, url_for
 
+from server import util
+
 BASE_DIR = pathlib.Path(__file__).resolve().parent.parent
 APPS_DIR = BASE_DIR / "apps"
 LOG_DIR = BASE_DIR / "logs"
 
+_HEALTH_RESPONSE = (b"ok", 200, {"Content-Type": "text/plain; charset=utf-8"})
+
+
+_LOG_LISTENER: Optional[QueueListener] = None
+
 
 def configure_logging() -> None:
+    """Route log records through a queue drained by a background thread.
+
+    Request handlers only enqueue records; the rotating file (or the
+    stdout/stderr fallback) is written from the listener thread.
+    """
+
+    if _LOG_LISTENER is not None:
+        return
+
     formatter = logging.Formatter(
         "%(asctime)s %(levelname)s [%(name)s] %(message)s"
     )
@@ -20,6 +38,10 @@ def configure_logging() -> None:
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
 
+    # Handlers installed before us (gunicorn, basicConfig) move behind the queue too.
+    handlers: List[logging.Handler] = list(root_logger.handlers)
+    fallback_error: Optional[OSError] = None
+
     try:
         LOG_DIR.mkdir(parents=True, exist_ok=True)
         log_file = LOG_DIR / "dt-relay.log"
@@ -27,27 +49,54 @@ def configure_logging() -> None:
         handler = RotatingFileHandler(log_file, maxBytes=1_048_576, backupCount=5)
         handler.setLevel(logging.INFO)
         handler.setFormatter(formatter)
+        handlers.append(handler)
 
     except OSError as exc:
-        for existing in root_logger.handlers:
+        fallback_error = exc
+        for existing in handlers:
             if isinstance(existing, logging.StreamHandler):
                 break
         else:
             stream_handler = logging.StreamHandler()
             stream_handler.setLevel(logging.INFO)
             stream_handler.setFormatter(formatter)
-            root_logger.addHandler(stream_handler)
+            handlers.append(stream_handler)
+
+    for existing in list(root_logger.handlers):
+        root_logger.removeHandler(existing)
 
+    _start_log_listener(handlers)
+    atexit.register(_stop_log_listener)
+    os.register_at_fork(after_in_child=_restart_log_listener)
+
+    if fallback_error is not None:
         root_logger.warning(
-            "File logging disabled; falling back to stdout/stderr (%s)", exc,
+            "File logging disabled; falling back to stdout/stderr (%s)", fallback_error,
         )
-        return
 
-    for existing in root_logger.handlers:
-        if isinstance(existing, RotatingFileHandler) and getattr(existing, "baseFilename", None) == str(log_file):
-            break
-    else:
-        root_logger.addHandler(handler)
+
+def _start_log_listener(handlers: List[logging.Handler]) -> None:
+    global _LOG_LISTENER
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    for existing in list(root_logger.handlers):
+        if isinstance(existing, QueueHandler):
+            root_logger.removeHandler(existing)
+    root_logger.addHandler(QueueHandler(log_queue))
+    _LOG_LISTENER = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _LOG_LISTENER.start()
+
+
+def _stop_log_listener() -> None:
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.stop()
+
+
+def _restart_log_listener() -> None:
+    # A forked worker (e.g. gunicorn --preload) inherits the listener object
+    # but not its thread, so records would queue up and never be written.
+    if _LOG_LISTENER is not None:
+        _start_log_listener(list(_LOG_LISTENER.handlers))
 
 
 class SubApp:
@@ -60,16 +109,19 @@ class SubApp:
 def create_app() -> Flask:
     configure_logging()
     app = Flask(__name__, template_folder=str(APPS_DIR / "core"))
-    app.config["AUTH_PASSWORD"] = os.getenv("AUTH_PASSWORD", "")
-    default_host = os.getenv("DEFAULT_DIM_HOST") or os.getenv(
+    app.config["MAX_CONTENT_LENGTH"] = util.MAX_FORM_BYTES
+    env = os.environ
+    app.config["AUTH_PASSWORD"] = env.get("AUTH_PASSWORD", "")
+    default_host = env.get("DEFAULT_DIM_HOST") or env.get(
         "DEFAULT_DIM_SYSTEM", "dd-system-01"
     )
-    default_environment = os.getenv("DEFAULT_DIM_ENVIRONMENT") or os.getenv(
+    default_environment = env.get("DEFAULT_DIM_ENVIRONMENT") or env.get(
         "DEFAULT_DIM_SITE", "primary-dc"
     )
     app.config["DEFAULT_DIM_HOST"] = default_host
     app.config["DEFAULT_DIM_ENVIRONMENT"] = default_environment
-    app.config["METRIC_PREFIX"] = os.getenv("METRIC_PREFIX", "custom.ddfs")
+    app.config["METRIC_PREFIX"] = env.get("METRIC_PREFIX", "custom.ddfs")
+    app.config["DT_INGEST_GZIP"] = env.get("DT_INGEST_GZIP", "").lower() in {"1", "true", "yes"}
 
     subapps = load_subapps(app)
 
@@ -95,17 +147,19 @@ def create_app() -> Flask:
     @app.route("/health")
     @app.route("/dt-relay/health")
     def health():
-        return ("ok", 200, {"Content-Type": "text/plain; charset=utf-8"})
+        return _HEALTH_RESPONSE
 
     return app
 
 
 def load_subapps(app: Flask) -> List[SubApp]:
     subapps: List[SubApp] = []
-    for path in sorted(APPS_DIR.iterdir()):
-        if not path.is_dir():
-            continue
-        module_name = f"apps.{path.name}.routes"
+    # DirEntry caches the file type from the directory listing, so this does
+    # not stat each entry a second time.
+    with os.scandir(APPS_DIR) as it:
+        entries = sorted((e for e in it if e.is_dir()), key=lambda e: e.name)
+    for entry in entries:
+        module_name = f"apps.{entry.name}.routes"
         try:
             module = importlib.import_module(module_name)
         except ModuleNotFoundError:
@@ -115,7 +169,7 @@ def load_subapps(app: Flask) -> List[SubApp]:
             continue
         blueprint, metadata = register(app)
         app.register_blueprint(blueprint)
-        subapps.append(SubApp(path.name, blueprint, metadata))
+        subapps.append(SubApp(entry.name, blueprint, metadata))
     app.config["SUBAPPS"] = subapps
     return subapps
 
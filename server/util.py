@@ -1,38 +1,115 @@
+import atexit
+import functools
+import gzip
 import json
+import logging
+import math
 import pathlib
 import re
+import threading
 import time
-from dataclasses import dataclass
+import types
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from decimal import Decimal, InvalidOperation
-from typing import Dict, List, Optional, Set
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
 CONFIG_DIR = pathlib.Path(__file__).resolve().parent.parent / "config"
 
+MAX_FORM_BYTES = 1_048_576
+GZIP_MIN_BYTES = 1024
+MAX_INGEST_WORKERS = 32
+FORM_MIMETYPES = frozenset({"application/x-www-form-urlencoded", "multipart/form-data"})
+
+
+class SanitizedItems(tuple):
+    """Dimension items that have already been sanitised, as ``(key, value)`` pairs.
 
-@dataclass
+    Used for a tenant's ``sanitized_static_dims``.
+    """
+
+
+@dataclass(slots=True)
 class Tenant:
     id: str
     label: str
     base_url: str
     metric_prefix: Optional[str]
-    static_dims: Dict[str, str]
+    static_dims: Mapping[str, str]
+    sanitized_static_dims: SanitizedItems
+
+
+@dataclass(slots=True)
+class TenantResult:
+    label: str
+    status: object
+    message: str
+    success: bool
+    lines: List[str] = field(default_factory=list)
+    response_text: str = ""
+    warnings: List[str] = field(default_factory=list)
 
 
 class TenantRegistry:
-    """Lazy loader for tenant configuration."""
+    """Lazy loader for tenant configuration.
+
+    The parsed registry is kept for the life of the process and only re-read
+    when the modification time of ``tenants.json`` changes. It is returned as
+    a read-only mapping, and each tenant's ``static_dims`` is read-only too.
+    If a reload fails (the file is missing or does not parse), the last good
+    registry keeps being served and the read is retried on the next call.
+    """
 
-    _tenants: Optional[Dict[str, Tenant]] = None
+    _tenants: Optional[Mapping[str, Tenant]] = None
+    _mtime_ns: Optional[int] = None
+    _warned_mtime_ns: Optional[int] = None
+    _lock = threading.Lock()
 
     @classmethod
-    def load(cls) -> Dict[str, Tenant]:
-        if cls._tenants is not None:
+    def load(cls) -> Mapping[str, Tenant]:
+        tenants_path = CONFIG_DIR / "tenants.json"
+        try:
+            mtime_ns: Optional[int] = tenants_path.stat().st_mtime_ns
+        except OSError:
+            mtime_ns = None  # read_bytes below raises the real error
+        if cls._tenants is not None and cls._mtime_ns == mtime_ns:
             return cls._tenants
 
-        tenants_path = CONFIG_DIR / "tenants.json"
-        with tenants_path.open("r", encoding="utf-8") as fp:
-            raw = json.load(fp)
+        with cls._lock:
+            if cls._tenants is not None and cls._mtime_ns == mtime_ns:
+                return cls._tenants
+
+            try:
+                tenants = cls._parse(tenants_path.read_bytes())
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as exc:
+                if cls._tenants is None:
+                    raise
+                # The file may be caught mid-write within one mtime tick, so the
+                # read is retried on the next call; only the warning is per edit.
+                if cls._warned_mtime_ns != mtime_ns:
+                    cls._warned_mtime_ns = mtime_ns
+                    logger.warning(
+                        "Could not reload %s, keeping the previous tenants: %r",
+                        tenants_path,
+                        exc,
+                    )
+                return cls._tenants
+
+            # Published read-only so request handlers can share it without copying.
+            cls._tenants = types.MappingProxyType(tenants)
+            cls._mtime_ns = mtime_ns
+            cls._warned_mtime_ns = None
+            return cls._tenants
+
+    @staticmethod
+    def _parse(data: bytes) -> Dict[str, Tenant]:
+        raw = json.loads(data)
 
         tenants: Dict[str, Tenant] = {}
         if isinstance(raw, dict):
@@ -41,21 +118,35 @@ class TenantRegistry:
             iterable = raw
 
         for entry in iterable:
+            static_dims = dict(entry.get("staticDims", {}) or {})
+            sanitized_static_dims: Dict[str, str] = {}
+            _sanitize_into(sanitized_static_dims, static_dims.items())
             tenant = Tenant(
                 id=entry["id"],
                 label=entry.get("label", entry["id"]),
                 base_url=entry["baseUrl"].rstrip("/"),
                 metric_prefix=entry.get("metricPrefix"),
-                static_dims=entry.get("staticDims", {}) or {},
+                static_dims=types.MappingProxyType(static_dims),
+                # Immutable items, which merge_dimensions copies without re-sanitising.
+                sanitized_static_dims=SanitizedItems(sanitized_static_dims.items()),
             )
             tenants[tenant.id] = tenant
-        cls._tenants = tenants
         return tenants
 
 
-_KEY_INVALID_CHARS = re.compile(r"[^a-zA-Z0-9_.:-]")
+# Underscore is deliberately left out of the allowed set so a run of invalid
+# characters and underscores collapses to a single "_" in one pass.
+_KEY_INVALID_RUN = re.compile(r"[^a-zA-Z0-9.:-]+")
 _METRIC_KEY_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9_.:-]*$")
 _DIM_KEY_PATTERN = re.compile(r"^[a-zA-Z][a-zA-Z0-9_.:-]*$")
+_KEY_INVALID_SUB = _KEY_INVALID_RUN.sub
+_METRIC_KEY_MATCH = _METRIC_KEY_PATTERN.match
+_DIM_KEY_MATCH = _DIM_KEY_PATTERN.match
+
+# Keys come straight from user-submitted forms and can be as long as the body
+# cap, so normalise_dimension_key and _combine_metric_key only memoise keys up
+# to this length.
+_CACHEABLE_KEY_CHARS = 256
 
 
 def _normalise_key(raw: Optional[str]) -> str:
@@ -64,14 +155,7 @@ def _normalise_key(raw: Optional[str]) -> str:
     if raw is None:
         return ""
 
-    cleaned = raw.strip().replace(" ", "_")
-    if not cleaned:
-        return ""
-
-    cleaned = _KEY_INVALID_CHARS.sub("_", cleaned)
-    cleaned = re.sub(r"_+", "_", cleaned)
-    cleaned = cleaned.strip("_.:-")
-
+    cleaned = _KEY_INVALID_SUB("_", raw).strip("_.:-")
     if not cleaned:
         return ""
 
@@ -81,27 +165,52 @@ def _normalise_key(raw: Optional[str]) -> str:
     return cleaned
 
 
+_DIM_ESCAPE_TABLE = str.maketrans({"\\": "\\\\", ",": "\\,", " ": "\\ ", "=": "\\="})
+
+
 def escape_dimension(value: str) -> str:
-    replacers = {"\\": "\\\\", ",": "\\,", " ": "\\ ", "=": "\\="}
-    escaped = []
-    for ch in value:
-        escaped.append(replacers.get(ch, ch))
-    return "".join(escaped)
+    # Most values (hostnames, IDs) need no escaping; return them untouched.
+    if "\\" not in value and "," not in value and " " not in value and "=" not in value:
+        return value
+    return value.translate(_DIM_ESCAPE_TABLE)
 
 
-def normalise_dimension_key(raw_key: Optional[str]) -> str:
+def _dimension_key(raw_key: Optional[str]) -> str:
     key = _normalise_key(raw_key)
-    if key and _DIM_KEY_PATTERN.match(key):
+    if key and _DIM_KEY_MATCH(key):
         return key
     return ""
 
 
+_cached_dimension_key = functools.lru_cache(maxsize=1024)(_dimension_key)
+
+
+def normalise_dimension_key(raw_key: Optional[str]) -> str:
+    if raw_key is not None and len(raw_key) > _CACHEABLE_KEY_CHARS:
+        return _dimension_key(raw_key)
+    return _cached_dimension_key(raw_key)
+
+
 def normalise_metric_key(metric_prefix: Optional[str], raw_key: Optional[str]) -> str:
+    return _combine_metric_key(_normalise_key(metric_prefix), raw_key)
+
+
+def _combine_metric_key(prefix: str, raw_key: Optional[str]) -> str:
+    """Join an already normalised prefix with a raw metric key."""
+
+    # The prefix can come from the generic metrics form too.
+    if len(prefix) > _CACHEABLE_KEY_CHARS or (
+        raw_key is not None and len(raw_key) > _CACHEABLE_KEY_CHARS
+    ):
+        return _join_metric_key(prefix, raw_key)
+    return _cached_metric_key(prefix, raw_key)
+
+
+def _join_metric_key(prefix: str, raw_key: Optional[str]) -> str:
     suffix = _normalise_key(raw_key)
     if not suffix:
         return ""
 
-    prefix = _normalise_key(metric_prefix)
     if prefix:
         if suffix.startswith(prefix):
             candidate = suffix
@@ -110,20 +219,40 @@ def normalise_metric_key(metric_prefix: Optional[str], raw_key: Optional[str]) -
     else:
         candidate = suffix
 
-    if _METRIC_KEY_PATTERN.match(candidate):
+    if _METRIC_KEY_MATCH(candidate):
         return candidate
     return ""
 
 
-def sanitize_dims(values: Dict[str, str]) -> Dict[str, str]:
-    sanitized: Dict[str, str] = {}
-    for raw_key, raw_value in values.items():
+_cached_metric_key = functools.lru_cache(maxsize=8192)(_join_metric_key)
+
+
+def _sanitize_into(target: Dict[str, str], items: Iterable[Tuple[str, object]]) -> None:
+    """Sanitise ``items`` and store them in ``target``, later keys winning."""
+
+    for raw_key, raw_value in items:
         if raw_value in (None, ""):
             continue
         key = normalise_dimension_key(raw_key)
-        if not key:
-            continue
-        sanitized[key] = escape_dimension(str(raw_value))
+        if key:
+            target[key] = escape_dimension(
+                raw_value if type(raw_value) is str else str(raw_value)
+            )
+
+
+class SanitizedDims(dict):
+    """Dimensions that have already been through sanitize_dims.
+
+    Escaping is not idempotent, so consumers use this type to tell whether
+    a mapping still needs sanitising.
+    """
+
+
+def sanitize_dims(values: Mapping[str, str]) -> SanitizedDims:
+    # Not memoised: tenant static dims are sanitised once at load, and the
+    # remaining callers pass per-request form values that rarely repeat.
+    sanitized = SanitizedDims()
+    _sanitize_into(sanitized, values.items())
     return sanitized
 
 
@@ -141,42 +270,89 @@ def build_unit_metadata(metric_name: str, unit: Optional[str]) -> Optional[str]:
     return f"#{metric_name} gauge dt.meta.unit=\"{escaped}\""
 
 
+_FLOAT_EXACT_LIMIT = 2 ** 53
+
+
+def _format_value(text: str) -> Optional[str]:
+    """Return the line-protocol rendering of ``text`` or None if it is not numeric."""
+
+    try:
+        # Form values are almost always plain integers (byte and alert counts).
+        return str(int(text))
+    except ValueError:
+        pass
+
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+
+    # Dynatrace stores doubles, so anything that overflows one is dropped and
+    # the shortest round-trip repr loses nothing. Values floats cannot hold
+    # exactly, or that repr would print in exponent form, keep the
+    # fixed-point Decimal rendering.
+    if not math.isfinite(number):
+        return None
+    if abs(number) >= _FLOAT_EXACT_LIMIT:
+        return _format_decimal(text)
+    if number.is_integer():
+        return str(int(number))
+    rendered = repr(number)
+    if "e" in rendered:
+        return _format_decimal(text)
+    return rendered
+
+
+def _format_decimal(text: str) -> Optional[str]:
+    """Return a fixed-point rendering of ``text`` or None if it is not a finite number."""
+
+    try:
+        numeric_value = Decimal(text)
+    except InvalidOperation:
+        return None
+    if not numeric_value.is_finite():
+        return None
+    rendered = format(numeric_value, "f")
+    if "." in rendered:
+        rendered = rendered.rstrip("0").rstrip(".")
+    return rendered
+
+
+def dims_suffix(dims: Mapping[str, str]) -> str:
+    """Return the ``,key=value`` run appended to a metric key for sanitised ``dims``."""
+
+    if not dims:
+        return ""
+    return "," + ",".join(f"{k}={v}" for k, v in dims.items())
+
+
 class MetricsBuilder:
     def __init__(
         self,
         metric_prefix: str,
-        dims: Dict[str, str],
+        dims: Mapping[str, str],
         timestamp_ms: Optional[int],
     ):
         self.metric_prefix = metric_prefix
-        self.dims = sanitize_dims(dims)
+        self._norm_prefix = _normalise_key(metric_prefix)
+        self.dims = dims if isinstance(dims, SanitizedDims) else sanitize_dims(dims)
         self.timestamp_ms = timestamp_ms
         self._metadata_sent: Set[str] = set()
+        # Dimensions and timestamp are shared by every line this builder emits.
+        self._dims_suffix = dims_suffix(self.dims)
+        self._ts_suffix = f" {timestamp_ms}" if timestamp_ms is not None else ""
 
     def build_line(
         self, metric_suffix: str, value: str, unit: Optional[str] = None
     ) -> List[str]:
-        try:
-            numeric_value = Decimal(str(value))
-        except (InvalidOperation, TypeError):
+        value_fragment = _format_value(str(value))
+        if value_fragment is None:
             return []
 
-        metric_name = normalise_metric_key(self.metric_prefix, metric_suffix)
+        metric_name = _combine_metric_key(self._norm_prefix, metric_suffix)
         if not metric_name:
             return []
 
-        dims = ",".join(f"{k}={v}" for k, v in self.dims.items())
-        if dims:
-            metric_fragment = f"{metric_name},{dims}"
-        else:
-            metric_fragment = metric_name
-
-        if numeric_value == numeric_value.to_integral():
-            normalized = numeric_value.quantize(Decimal("1"))
-        else:
-            normalized = numeric_value.normalize()
-        value_fragment = format(normalized, "f")
-
         lines: List[str] = []
         if unit and metric_name not in self._metadata_sent:
             metadata_line = build_unit_metadata(metric_name, unit)
@@ -184,31 +360,141 @@ class MetricsBuilder:
                 lines.append(metadata_line)
                 self._metadata_sent.add(metric_name)
 
-        if self.timestamp_ms is not None:
-            data_line = f"{metric_fragment} {value_fragment} {self.timestamp_ms}"
-        else:
-            data_line = f"{metric_fragment} {value_fragment}"
-
-        lines.append(data_line)
+        lines.append(f"{metric_name}{self._dims_suffix} {value_fragment}{self._ts_suffix}")
         return lines
 
+
+def reject_form_request(content_length: Optional[int], mimetype: str) -> Optional[Tuple[str, int]]:
+    """Return an error response for bodies that should never reach form parsing."""
+
+    if content_length is not None and content_length > MAX_FORM_BYTES:
+        return ("Request body too large", 413)
+    if mimetype not in FORM_MIMETYPES:
+        return ("Unsupported content type", 415)
+    return None
+
+
 def current_time_ms() -> int:
-    return int(time.time() * 1000)
+    return time.time_ns() // 1_000_000
+
+
+def _build_session() -> requests.Session:
+    """Return a session that keeps connections to Dynatrace tenants alive."""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        # Only connection failures are retried: urllib3 never retries POST on a
+        # response status, and doing so could ingest the same lines twice.
+        max_retries=Retry(total=2, backoff_factor=0.1),
+    )
+    session.mount("https://", adapter)
+    return session
 
 
-def post_metrics(tenant: Tenant, token: str, lines: List[str]) -> requests.Response:
+_SESSION = _build_session()
+
+
+def close_session() -> None:
+    _SESSION.close()
+
+
+atexit.register(close_session)
+
+
+def post_metrics(
+    tenant: Tenant, token: str, lines: List[str], compress: bool = False
+) -> requests.Response:
     url = f"{tenant.base_url}/api/v2/metrics/ingest"
-    payload = "\n".join(lines)
     headers = {
         "Authorization": f"Api-Token {token}",
         "Content-Type": "text/plain; charset=utf-8",
     }
-    response = requests.post(url, data=payload.encode("utf-8"), headers=headers, timeout=10)
+    payload = "\n".join(lines).encode("utf-8")
+    if compress and len(payload) >= GZIP_MIN_BYTES:
+        # Line protocol repeats metric names and dimensions, so even the
+        # fastest compression level shrinks it several times over.
+        payload = gzip.compress(payload, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    response = _SESSION.post(url, data=payload, headers=headers, timeout=10)
     return response
 
 
-def merge_dimensions(*dicts: Dict[str, str]) -> Dict[str, str]:
-    merged: Dict[str, str] = {}
+def coalesce_lines(line_groups: Iterable[List[str]]) -> List[str]:
+    """Concatenate payloads bound for the same ingest endpoint.
+
+    Metadata lines are only kept the first time they appear so a metric's
+    unit is declared once per request.
+    """
+
+    combined: List[str] = []
+    metadata_seen: Set[str] = set()
+    for lines in line_groups:
+        for line in lines:
+            if line.startswith("#"):
+                if line in metadata_seen:
+                    continue
+                metadata_seen.add(line)
+            combined.append(line)
+    return combined
+
+
+# (base_url, token) -> the tenants posting there, each with its result so far.
+PendingIngest = Mapping[Tuple[str, str], Sequence[Tuple[Tenant, TenantResult]]]
+PostOutcome = Union[requests.Response, Exception]
+
+
+def post_grouped(
+    pending: PendingIngest, compress: bool = False
+) -> Dict[Tuple[str, str], PostOutcome]:
+    """POST each group's coalesced lines and return the response per group.
+
+    A group whose POST raises maps to the exception instead. Payloads are
+    prepared by the caller; only the Dynatrace round trips run concurrently,
+    so total latency tracks the slowest endpoint. A single group is posted
+    on the calling thread. ``compress`` gzips bodies of GZIP_MIN_BYTES or
+    more; the app enables it via DT_INGEST_GZIP.
+    """
+
+    if len(pending) <= 1:
+        return {
+            key: _post_group(key[1], members, compress) for key, members in pending.items()
+        }
+
+    with ThreadPoolExecutor(max_workers=min(MAX_INGEST_WORKERS, len(pending))) as executor:
+        futures = {
+            key: executor.submit(_post_group, key[1], members, compress)
+            for key, members in pending.items()
+        }
+        return {key: future.result() for key, future in futures.items()}
+
+
+def _post_group(
+    token: str, members: Sequence[Tuple[Tenant, TenantResult]], compress: bool
+) -> PostOutcome:
+    # Every member shares the same base URL, so any tenant can address the POST.
+    payload = coalesce_lines(result.lines for _, result in members)
+    try:
+        return post_metrics(members[0][0], token, payload, compress)
+    except Exception as exc:  # noqa: BLE001
+        return exc
+
+
+def merge_dimensions(*dicts: Union[Mapping[str, str], SanitizedItems]) -> SanitizedDims:
+    """Merge ``dicts`` left to right into one sanitised mapping.
+
+    SanitizedDims and SanitizedItems inputs, such as a tenant's
+    ``sanitized_static_dims``, are copied as they are; other mappings are
+    sanitised.
+    """
+
+    merged = SanitizedDims()
     for d in dicts:
-        merged.update({k: v for k, v in (d or {}).items() if v not in (None, "")})
+        if not d:
+            continue
+        if isinstance(d, (SanitizedItems, SanitizedDims)):
+            merged.update(d)
+        else:
+            _sanitize_into(merged, d.items())
     return merged